@@ -0,0 +1,42 @@
+"""Measure how long it takes to start entium for each mode.
+
+Every measurement runs in a fresh interpreter so nothing is cached between runs:
+
+  python benchmarks/import_time.py [-n RUNS]
+"""
+from argparse import ArgumentParser
+import os
+import subprocess
+import sys
+import timeit
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+  ('python', 'pass'),
+  ('entium cli', 'import entium.__main__'),
+  ('tileset mode', 'import entium.hierarchy'),
+  ('tile mode', 'import entium.converter')
+]
+
+def time_statement(statement, runs):
+  command = [ sys.executable, '-c', statement ]
+  timer = timeit.Timer(lambda: subprocess.check_call(command, cwd=PROJECT_DIR))
+  return min(timer.repeat(repeat=runs, number=1))
+
+def loads_numpy(statement):
+  check = '%s; import sys; sys.exit(\'numpy\' in sys.modules)' % statement
+  return subprocess.call([ sys.executable, '-c', check ], cwd=PROJECT_DIR) != 0
+
+def main():
+  parser = ArgumentParser(description='Benchmark the startup time of entium')
+  parser.add_argument('-n', '--runs', type=int, default=10, help='number of runs, the fastest is reported')
+  args = parser.parse_args()
+
+  for name, statement in STATEMENTS:
+    elapsed = time_statement(statement, args.runs)
+    print('%-14s %8.1f ms %s' % (name, elapsed * 1000, '(loads numpy)' if loads_numpy(statement) else ''))
+
+if __name__ == '__main__':
+  main()
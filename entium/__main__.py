@@ -2,11 +2,10 @@ from argparse import ArgumentParser, ArgumentTypeError, Action
 import json
 import logging
 import os
+import sys
 
 from . import __version__
-from .converter import convert_tiles, convert_hierarchy
 from .cesium.config import cesium_settings_from_entwine_config
-from enum import Enum
 
 
 logging.basicConfig(level=logging.INFO)
@@ -34,12 +33,24 @@ def main():
 
     return filename
 
-  parser.add_argument('mode', choices=['tileset', 'tile', 'both'])
+  def is_positive_int(value):
+    try:
+      number = int(value)
+    except ValueError:
+      raise ArgumentTypeError('{0} is not an integer'.format(value))
+    if number <= 0:
+      raise ArgumentTypeError('{0} is not a positive integer'.format(value))
+    return number
+
+  parser.add_argument('mode', choices=['tileset', 'tile', 'both', 'verify'])
   parser.add_argument('entwine_dir', action=FullPaths, type=is_dir, help='input folder for entwine')
   parser.add_argument('output_dir', action=FullPaths, type=is_dir, help='output folder for the cesium tilests')
   parser.add_argument('-p', '--precision', nargs='?', type=float, default=0.01, help='precision in meters required to use quantized tiles')
   parser.add_argument('-c', '--config', action=FullPaths, nargs='?', type=is_json, help='filepath to config file to use advanced features')
   parser.add_argument('--validate', action='store_true', help='run post-process to validate point precision')
+  parser.add_argument('--chunk-size', type=is_positive_int, help='number of points converted at a time, limits memory use on large tiles')
+  parser.add_argument('-s', '--store', action=FullPaths, help='folder to keep one copy of each unique tile in, outputs are hard links to it (must be on the same filesystem as output_dir)')
+  parser.add_argument('-j', '--jobs', type=is_positive_int, help='number of processes used to verify tiles, defaults to the cpu count')
   parser.add_argument('--version', action='version', version='%(prog)s {version}'.format(version=__version__))
 
   args = parser.parse_args()
@@ -51,14 +62,23 @@ def main():
 
       groups, batched = cesium_settings_from_entwine_config(config)
 
+  # Converter modules pull in numpy, only import them for the modes that need them
   # TODO - Multithread
   if args.mode == 'both' or args.mode == 'tile':
+    from .converter import convert_tiles
     logger.info('Converting tiles...')
-    convert_tiles(args.entwine_dir, args.output_dir, args.precision, args.validate, groups, batched)
+    convert_tiles(args.entwine_dir, args.output_dir, args.precision, args.validate, groups, batched, args.chunk_size, args.store)
 
   if args.mode == 'both' or args.mode == 'tileset':
+    from .hierarchy import convert_hierarchy
     logger.info('Generating tileset hierarchy...')
     convert_hierarchy(args.entwine_dir, args.output_dir)
 
+  if args.mode == 'verify':
+    from .converter import verify_tiles
+    logger.info('Verifying tiles...')
+    if verify_tiles(args.entwine_dir, args.output_dir, args.precision, groups, batched, args.chunk_size, args.jobs) > 0:
+      sys.exit(1)
+
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -0,0 +1,136 @@
+import json
+
+import numpy as np
+
+from .tiles import BatchComponentType, BatchType, PNTS_HEADER, QUANTIZED_ECEF_CONSTANT
+
+
+class PointcloudReader(object):
+
+  # Default layout of the binary feature semantics
+  # https://github.com/AnalyticalGraphicsInc/3d-tiles/blob/master/TileFormats/PointCloud/README.md#point-semantics
+  SEMANTICS = {
+    'POSITION': (np.float32, 3),
+    'POSITION_QUANTIZED': (np.uint16, 3),
+    'FLOATING_POSITION_QUANTIZED': (np.float32, 3),
+    'RGBA': (np.uint8, 4),
+    'RGB': (np.uint8, 3),
+    'RGB565': (np.uint16, 1),
+    'NORMAL': (np.float32, 3),
+    'NORMAL_OCT16P': (np.uint8, 2),
+    'BATCH_ID': (np.uint16, 1)
+  }
+
+  def __init__(self, data):
+    self._data = data
+
+    (self.magic, self.version, self.byte_length,
+      self.feature_json_length, self.feature_binary_length,
+      self.batch_json_length, self.batch_binary_length) = PNTS_HEADER.unpack(self._data[:PNTS_HEADER.size].tobytes())
+
+    if self.magic != b'pnts':
+      raise ValueError('Expected a pnts tile but found magic %r' % self.magic)
+
+    self.feature_binary_offset = PNTS_HEADER.size + self.feature_json_length
+    self.batch_json_offset = self.feature_binary_offset + self.feature_binary_length
+    self.batch_binary_offset = self.batch_json_offset + self.batch_json_length
+
+    self.feature_table = self._load_json(PNTS_HEADER.size, self.feature_json_length)
+    self.batch_table = self._load_json(self.batch_json_offset, self.batch_json_length)
+
+  @classmethod
+  def load(cls, input_path):
+    # Memory map the tile, every column returned is a view into the file
+    return cls(np.memmap(input_path, dtype=np.uint8, mode='r'))
+
+  def _load_json(self, offset, length):
+    if length == 0:
+      return {}
+    return json.loads(self._data[offset:offset + length].tobytes().decode('utf-8'))
+
+  def _view(self, offset, dtype, components):
+    view = np.frombuffer(self._data, dtype=dtype, count=self.total_points * components, offset=offset)
+    return view if components == 1 else view.reshape(self.total_points, components)
+
+  @property
+  def total_points(self):
+    return self.feature_table['POINTS_LENGTH']
+
+  def features(self):
+    return [ name for name, value in self.feature_table.items() if isinstance(value, dict) and 'byteOffset' in value ]
+
+  def batches(self):
+    return [ name for name, value in self.batch_table.items() if isinstance(value, dict) and 'byteOffset' in value ]
+
+  def _feature_layout(self, name):
+    dtype, components = PointcloudReader.SEMANTICS[name]
+    if 'componentType' in self.feature_table[name]:
+      dtype = BatchComponentType[self.feature_table[name]['componentType']].value
+    return np.dtype(dtype), components
+
+  def _batch_layout(self, name):
+    reference = self.batch_table[name]
+    return np.dtype(BatchComponentType[reference['componentType']].value), BatchType[reference['type']].value
+
+  def feature(self, name):
+    dtype, components = self._feature_layout(name)
+    return self._view(self.feature_binary_offset + self.feature_table[name]['byteOffset'], dtype, components)
+
+  def batch(self, name):
+    reference = self.batch_table[name]
+    if not isinstance(reference, dict) or 'byteOffset' not in reference:
+      return reference # Instanced values are stored directly in the json
+    dtype, components = self._batch_layout(name)
+    return self._view(self.batch_binary_offset + reference['byteOffset'], dtype, components)
+
+  def positions(self, start=None, stop=None):
+    if 'POSITION_QUANTIZED' in self.feature_table:
+      scale = np.array(self.feature_table['QUANTIZED_VOLUME_SCALE']) / QUANTIZED_ECEF_CONSTANT
+      return self.feature('POSITION_QUANTIZED')[start:stop] * scale + self.feature_table['QUANTIZED_VOLUME_OFFSET']
+    elif 'FLOATING_POSITION_QUANTIZED' in self.feature_table:
+      scale = np.array(self.feature_table['QUANTIZED_VOLUME_SCALE'])
+      return self.feature('FLOATING_POSITION_QUANTIZED')[start:stop] * scale + self.feature_table['QUANTIZED_VOLUME_OFFSET']
+
+    points = self.feature('POSITION')[start:stop].astype(np.float64)
+    if 'RTC_CENTER' in self.feature_table:
+      points += self.feature_table['RTC_CENTER']
+    return points
+
+  # Returns a list of every layout problem found, empty when the tile is well formed
+  def validate(self):
+    errors = []
+    if self.version != 1:
+      errors.append('Unexpected version %d' % self.version)
+    # Every section has to start on an 8 byte boundary of the tile, the last one also has to end on one
+    sections = [
+      ('Feature table binary', self.feature_binary_offset),
+      ('Batch table json', self.batch_json_offset),
+      ('Batch table binary', self.batch_binary_offset),
+      ('End of tile', self.batch_binary_offset + self.batch_binary_length)
+    ]
+    for name, offset in sections:
+      if offset % 8 != 0:
+        errors.append('%s is at unaligned offset %d' % (name, offset))
+    if self.byte_length != len(self._data):
+      errors.append('File is %d bytes but byteLength is %d' % (len(self._data), self.byte_length))
+    if self.batch_binary_offset + self.batch_binary_length != len(self._data):
+      errors.append('File is %d bytes but header describes %d' % (len(self._data), self.batch_binary_offset + self.batch_binary_length))
+
+    def check(name, offset, dtype, components, binary_length):
+      if offset % dtype.itemsize != 0:
+        errors.append('%s byteOffset %d is not a multiple of %d' % (name, offset, dtype.itemsize))
+      if offset + dtype.itemsize * components * self.total_points > binary_length:
+        errors.append('%s extends past the end of its binary body' % name)
+
+    for name in self.features():
+      if name not in PointcloudReader.SEMANTICS:
+        errors.append('Unknown feature semantic %s' % name)
+        continue
+      dtype, components = self._feature_layout(name)
+      check(name, self.feature_table[name]['byteOffset'], dtype, components, self.feature_binary_length)
+
+    for name in self.batches():
+      dtype, components = self._batch_layout(name)
+      check(name, self.batch_table[name]['byteOffset'], dtype, components, self.batch_binary_length)
+
+    return errors
@@ -1,4 +1,5 @@
 import glob
+from io import BytesIO
 import json
 import os
 import struct
@@ -14,13 +15,40 @@ def get_padding_bytes(total_bytes, required_multiple):
   else:
     return 0 
 
+def iter_chunks(length, chunk_size=None):
+  step = chunk_size if chunk_size else max(length, 1)
+  for start in xrange(0, length, step):
+    yield start, min(start + step, length)
+
+# Numpy copies on multi-field indexing, build a view over the selected fields instead
+def select_fields(data, selection):
+  if not isinstance(selection, list):
+    return data[selection]
+
+  fields = data.dtype.fields
+  return data.view(np.dtype({
+    'names': selection,
+    'formats': [ fields[name][0] for name in selection ],
+    'offsets': [ fields[name][1] for name in selection ],
+    'itemsize': data.dtype.itemsize
+  }))
+
+# Copy the (possibly strided) fields of a structured array into a contiguous array
+def pack_fields(data):
+  if data.dtype.names is None:
+    return data
+  packed_dtype = np.dtype([ (name, data.dtype[name]) for name in data.dtype.names ])
+  return data.astype(packed_dtype, copy=False)
+
 def binjsonify(func):
   def wrapper(*args, **kwargs):
+    # Position of the json within the tile, the padding is relative to the start of the tile
+    header_offset = kwargs.pop('header_offset', 0)
     result = func(*args, **kwargs)
     json_dump = json.dumps(result, separators=(',', ':'))
     # Required 4  byte Padding for parsing of data (https://github.com/AnalyticalGraphicsInc/3d-tiles/blob/master/TileFormats/BatchTable/README.md#implementation-notes)
     # Doubled to 8 since 8 is the largest amount of bytes that can be stored
-    json_dump += ' ' * get_padding_bytes(len(json_dump), 8) 
+    json_dump += ' ' * get_padding_bytes(header_offset + len(json_dump), 8) 
     return json_dump.encode('utf-8'); 
   return wrapper
 
@@ -50,6 +78,9 @@ class Mode(Enum):
 # https://github.com/AnalyticalGraphicsInc/3d-tiles/tree/master/TileFormats/PointCloud#quantized-positions
 QUANTIZED_ECEF_CONSTANT = float(pow(2, 16) - 1)
 
+# https://github.com/AnalyticalGraphicsInc/3d-tiles/tree/master/TileFormats/PointCloud#layout
+PNTS_HEADER = struct.Struct('4sIIIIII')
+
 class AbstractColumn(object):
   def __init__(self, name, data):
     self.name = name
@@ -70,6 +101,12 @@ class AbstractColumn(object):
   def data(self):
     return self._data
 
+  def chunk(self, start, stop):
+    return pack_fields(self.data()[start:stop])
+
+  def rows(self):
+    return len(self._data)
+
   def count(self):
     return 1 if self._data.dtype.names is None else len(self._data.dtype.names)
 
@@ -80,10 +117,10 @@ class AbstractColumn(object):
       return self._data.dtype.names
   
   def get_itemsize(self):
-    return self.data().itemsize
+    return self.chunk(0, 0).itemsize
 
   def get_size(self):
-    return self.data().nbytes
+    return self.chunk(0, 1).nbytes * self.rows()
 
   def get_header(self, offset):
     raise NotImplementedError('get_header has not been implemented!')
@@ -152,11 +189,12 @@ class FeatureColumn(AbstractColumn):
     return header
 
 class PositionColumn(FeatureColumn):
-  def __init__(self, name, data, mode):
+  def __init__(self, name, data, mode, chunk_size=None):
     super(PositionColumn, self).__init__(name, data)
     self.length = self._data.size # Save the size before transform
-    self._data = self._data.view((self.dtype, 3))
     self.mode = mode
+    self.chunk_size = chunk_size
+    self._bounds = None
 
   def get_header(self, offset):
     if self.mode is Mode.RTC_CENTER or self.mode is Mode.STANDARD:
@@ -187,20 +225,39 @@ class PositionColumn(FeatureColumn):
     header['POINTS_LENGTH'] = self.length
     return header
 
+  def raw_points(self, start=None, stop=None):
+    return pack_fields(self._data[start:stop]).view((self.dtype, 3))
+
   @property
   def bounds(self):
-    return {
-      'min': np.min(self._data, axis=0),
-      'max': np.max(self._data, axis=0)
-    }
+    # Computed once over chunks, the positions never change after creation
+    if self._bounds is None:
+      mins, maxs = [], []
+      for start, stop in iter_chunks(self.length, self.chunk_size):
+        points = self.raw_points(start, stop)
+        mins.append(np.min(points, axis=0))
+        maxs.append(np.max(points, axis=0))
+      self._bounds = {
+        'min': np.min(mins, axis=0),
+        'max': np.max(maxs, axis=0)
+      }
+    return self._bounds
 
   def data(self):
+    return self.chunk(0, self.length)
+
+  def chunk(self, start, stop):
+    points = self.raw_points(start, stop)
     if self.mode is Mode.RTC_CENTER:
-      return self.rtc_points
+      return self._rtc(points)
     elif self.mode is Mode.QUANTIZED:
-      return self.quantized_points
+      return self._quantize(points)
     elif self.mode is Mode.FLOATING_QUANTIZED:
-      return self.normalized_points
+      return self._normalize(points)
+    return points
+
+  def rows(self):
+    return self.length
 
   @property
   def rtc_point(self):
@@ -208,8 +265,7 @@ class PositionColumn(FeatureColumn):
 
   @property
   def rtc_points(self):
-    return (self._data - self.rtc_point) \
-      .astype(np.float32)
+    return self._rtc(self.raw_points())
 
   @property
   def quantized_scale(self):
@@ -217,15 +273,54 @@ class PositionColumn(FeatureColumn):
       
   @property
   def quantized_points(self):
-    multiplier = QUANTIZED_ECEF_CONSTANT / self.quantized_scale
-    return ((self._data - self.bounds['min']) * multiplier) \
-      .astype(np.uint16)
+    return self._quantize(self.raw_points())
 
   @property
   def normalized_points(self):
-    return np.nan_to_num((self._data - self.bounds['min']) / self.quantized_scale) \
+    return self._normalize(self.raw_points())
+
+  def _rtc(self, points):
+    return (points - self.rtc_point) \
       .astype(np.float32)
 
+  def _quantize(self, points):
+    multiplier = QUANTIZED_ECEF_CONSTANT / self.quantized_scale
+    return ((points - self.bounds['min']) * multiplier) \
+      .astype(np.uint16)
+
+  def _normalize(self, points):
+    return np.nan_to_num((points - self.bounds['min']) / self.quantized_scale) \
+      .astype(np.float32)
+
+# Batch ids are looked up chunk by chunk against the sorted batch groups.
+# There is no stored data, so every method reading _data is overridden
+# and the data based checks of FeatureColumn are skipped.
+class BatchIdColumn(FeatureColumn):
+  def __init__(self, sources, names, batch_groups, length):
+    self.name = 'batch_id'
+    self.dtype = np.uint16
+    self.header_semantics = { 'BATCH_LENGTH': len(batch_groups) }
+    self.sources = sources
+    self.source_names = names
+    self.batch_groups = batch_groups
+    self.length = length
+
+  def data(self):
+    return self.chunk(0, self.length)
+
+  def chunk(self, start, stop):
+    merged = merge_batch_sources(self.sources, self.source_names, start, stop)
+    return np.searchsorted(self.batch_groups, merged).astype(self.dtype)
+
+  def rows(self):
+    return self.length
+
+  def count(self):
+    return 1
+
+  def names(self):
+    return [ self.name ]
+
 class Table(list):
 
   @binjsonify
@@ -242,9 +337,9 @@ class Table(list):
   def get_size(self):
     return reduce(lambda offset, item: offset + get_padding_bytes(offset, item.get_itemsize()) + item.get_size(), self, 0)
 
-  def write(self, write_buffer, byte_offset=0):
+  def write(self, write_buffer, byte_offset=0, chunk_size=None, header_offset=0):
     # Write Batch Table
-    write_buffer.write(self.get_header())
+    write_buffer.write(self.get_header(header_offset=header_offset))
     # Write each property sequentially
     for item in self:
       # Write padding to fix offset (Required that data starts on multiple of byte size to be parsed in JS)
@@ -252,7 +347,9 @@ class Table(list):
       write_buffer.write(struct.pack('x' * padding))
       byte_offset += padding
 
-      item.data().tofile(write_buffer)
+      for start, stop in iter_chunks(item.rows(), chunk_size):
+        # Write the array memory directly, tofile only supports real files
+        write_buffer.write(np.ascontiguousarray(item.chunk(start, stop)).data)
       byte_offset += item.get_size()
 
 
@@ -263,7 +360,12 @@ def merge_dicts(x, y):
     z.update(y)  # modifies z with y's keys and values & returns None
     return z
 
-def create_pointcloud(data, mode=None, groups=None, batch_columns=None):
+def merge_batch_sources(sources, names, start, stop):
+  merged = merge_arrays([ pack_fields(x[start:stop]) for x in sources ], flatten=True, usemask=False)
+  merged.dtype.names = names
+  return merged
+
+def create_pointcloud(data, mode=None, groups=None, batch_columns=None, chunk_size=None):
   if mode is None:
     mode = Mode.STANDARD
   if groups is None:
@@ -275,7 +377,7 @@ def create_pointcloud(data, mode=None, groups=None, batch_columns=None):
   columns = []
   def add(name, data):
     if name == 'position':
-      columns.append(PositionColumn(name, data, mode))
+      columns.append(PositionColumn(name, data, mode, chunk_size))
     elif name.lower() in FeatureColumn.TYPES:
       columns.append(FeatureColumn(name.lower(), data))
     else:
@@ -285,7 +387,7 @@ def create_pointcloud(data, mode=None, groups=None, batch_columns=None):
   # Remap columns based off their groupings
   grouped = set()
   for name, selection in groups.iteritems():
-    add(name, data[selection])
+    add(name, select_fields(data, selection))
     grouped.update(selection if isinstance(selection, list) else [selection])
   for column in (set(data.dtype.names) - grouped):
     add(column, data[column])
@@ -300,26 +402,26 @@ def create_pointcloud(data, mode=None, groups=None, batch_columns=None):
       r_columns.append(r_column)
       r_names.extend(r_column.names())
 
-    merged_data = merge_arrays([ x.data() for x in r_columns ], flatten=True, usemask=False)
-    merged_data.dtype.names = r_names
-    batch_groups, batch_ids = np.unique(merged_data, axis=0, return_inverse=True)
-    batch_ids = batch_ids.astype(np.uint16)
+    # Unique values are gathered per chunk, then merged into the sorted batch groups
+    sources = [ x.data() for x in r_columns ]
+    chunks = iter_chunks(len(data), chunk_size)
+    batch_groups = np.unique(np.concatenate([ np.unique(merge_batch_sources(sources, r_names, start, stop)) for start, stop in chunks ]))
 
-    idx_offset = 0
     for column in r_columns:
       column.is_instanced = True
       d_names = column.names()
       selector = d_names[0] if column.count() == 1 else d_names
       column._data = batch_groups[selector]
 
-    columns.append(FeatureColumn('batch_id', batch_ids, { 'BATCH_LENGTH': len(batch_groups) }))
+    columns.append(BatchIdColumn(sources, r_names, batch_groups, len(data)))
 
-  return PointcloudTile(columns)
+  return PointcloudTile(columns, chunk_size)
 
 class PointcloudTile(object):
 
-  def __init__(self, columns):
+  def __init__(self, columns, chunk_size=None):
     self.total_points = -1
+    self.chunk_size = chunk_size
     self.position_column = None
     self.feature_table = Table()
     self.batch_table = Table()
@@ -350,41 +452,51 @@ class PointcloudTile(object):
 
   @property
   def mode(self):
-    self.points.mode
+    return self.points.mode
 
   @mode.setter
   def mode(self, mode):
     self.points.mode = mode
 
+  def write(self, cesium_tile):
+    # Both json headers and binary bodies start and end on 8 byte boundaries of the tile
+    feature_header = self.feature_table.get_header(header_offset=PNTS_HEADER.size)
+    feature_size = self.feature_table.get_size()
+    padding = get_padding_bytes(PNTS_HEADER.size + feature_size + len(feature_header), 8)
+    batch_offset = PNTS_HEADER.size + len(feature_header) + feature_size + padding
+
+    # Skip writing if size is 0
+    if len(self.batch_table) > 0:
+      batch_header_length = len(self.batch_table.get_header(header_offset=batch_offset))
+      batch_size = self.batch_table.get_size()
+      batch_padding = get_padding_bytes(batch_size, 8)
+    else:
+      batch_header_length = 0
+      batch_size = 0
+      batch_padding = 0
+
+    # Write Header
+    cesium_tile.write(PNTS_HEADER.pack(
+      'pnts',                  # magic key (DO NOT CHANGE)
+      1,                       # Version, It has to be one according ot docs
+      batch_offset + batch_header_length + batch_size + batch_padding, # Byte length of the whole tile
+      len(feature_header),     # byte space of json info
+      feature_size + padding,  # byte space of feature data, we include padding as it will be excluded later
+      batch_header_length,     # byte space of json info
+      batch_size + batch_padding # byte space of batch data
+    ))
+
+    self.feature_table.write(cesium_tile, chunk_size=self.chunk_size, header_offset=PNTS_HEADER.size) # Write Feature Table
+    cesium_tile.write(struct.pack('x' * padding)) # Write Padding
+    if len(self.batch_table) > 0:
+      self.batch_table.write(cesium_tile, chunk_size=self.chunk_size, header_offset=batch_offset) # Write Batch table
+      cesium_tile.write(struct.pack('x' * batch_padding)) # Write Padding
+
   def save(self, output_path):
     with open(output_path, 'wb') as cesium_tile:
-      header_struct = struct.Struct('4sIIIIII')
-
-      feature_header = self.feature_table.get_header()
-      feature_size = self.feature_table.get_size()
-      padding = get_padding_bytes(header_struct.size + feature_size + len(feature_header), 8)
-
-      # Skip writing if size is 0
-      if len(self.batch_table) > 0:
-        batch_header_length = len(self.batch_table.get_header())
-        batch_size = self.batch_table.get_size()
-      else:
-        batch_header_length = 0
-        batch_size = 0
-
-      # Write Header
-      cesium_tile.write(header_struct.pack(
-        'pnts',                  # magic key (DO NOT CHANGE)
-        1,                       # Version, It has to be one according ot docs
-        0,                       # Byte length (currently unread)
-        len(feature_header),     # byte space of json info
-        feature_size + padding,  # byte space of feature data, we include padding as it will be excluded later
-        batch_header_length,     # byte space of json info
-        batch_size              # byte space of batch data
-      ))
-
-      self.feature_table.write(cesium_tile) # Write Feature Table
-      cesium_tile.write(struct.pack('x' * padding)) # Write Padding
-      if len(self.batch_table) > 0:
-        self.batch_table.write(cesium_tile) # Write Batch table
+      self.write(cesium_tile)
 
+  def to_bytes(self):
+    cesium_tile = BytesIO()
+    self.write(cesium_tile)
+    return cesium_tile.getvalue()
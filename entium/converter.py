@@ -1,96 +1,31 @@
+from functools import partial
 import glob
 import json
 import logging
+from multiprocessing import Pool
 import os
+import struct
 
-from .cesium.tiles import create_pointcloud, Mode, BatchComponentType, QUANTIZED_ECEF_CONSTANT
-from .cesium.tileset import DirectTile, ReferenceTile
+from . import __version__
+from .cesium.reader import PointcloudReader
+from .cesium.tiles import create_pointcloud, iter_chunks, merge_dicts, Mode, BatchComponentType, FeatureColumn, DEFAULT_GROUPS, QUANTIZED_ECEF_CONSTANT
+from .hierarchy import get_tileset_json, convert_hierarchy
+from .store import remove_file, TileStore
 from enum import Enum, IntEnum
 import numpy as np
 
 
 logger = logging.getLogger(__name__)
 
-def get_tileset_json(header, root_directory, global_meta):
-  tileset = {}
+# get_tileset_json and convert_hierarchy moved to hierarchy.py, they are re-exported for existing callers
+__all__ = [
+  'get_tileset_json', 'convert_hierarchy',
+  'import_entwine_table', 'EntwineScemaType', 'get_schema_type', 'get_entwine_schema', 'get_entwine_header',
+  'DEFAULT_PRECISION', 'TileConverter', 'get_cesium_path', 'convert_tiles', 'compare_tile', 'verify_tile', 'verify_tiles'
+]
 
-  def _find_children(tile):
-    if tile.depth + 1 not in tileset:
-      return []
-    x = tile.x * 2
-    y = tile.y * 2
-    z = tile.z * 2
-
-    def is_within_cartesian(test_tile):
-      return x <= test_tile.x < x + 2 and y <= test_tile.y < y + 2 and z <= test_tile.z < z + 2
-
-    return filter(is_within_cartesian, tileset[tile.depth + 1])
-
-  def _link_children(parents):
-    for parent in parents:
-      if isinstance(parent, ReferenceTile):
-        continue
-      parent.children = _find_children(parent)
-      _link_children(parent.children)
-    return parents
-  
-  # Get basic info on depth requirements
-  base_depth = int(header.split('-')[0])
-  step_size = 0 if 'hierarchyStep' not in global_meta else global_meta['hierarchyStep']
-
-  tileset_path = os.path.join(root_directory, 'h', header)
-  with open(tileset_path) as data_file:
-    data = json.load(data_file)
-    for tile_file in data.keys():
-      tile_meta = map(int, tile_file.split('.')[0].split('-'))
-      depth = tile_meta[0]
-      if depth not in tileset:
-        tileset[depth] = []
-      is_reference = step_size != 0 and depth != base_depth and depth % step_size == 0
-      tileset[depth].append(ReferenceTile(*tile_meta) if is_reference else DirectTile(*tile_meta))
-
-  # Find all children at 
-  root = _link_children(tileset[base_depth])[0]
-
-  return {
-    'asset': {
-      'version': '0.0'
-    },
-    'geometricError': root.get_geometric_error(global_meta),
-    'root': root.get_json(global_meta)
-  }
-
-def convert_hierarchy(input_path, output_path):
-  if not os.path.isdir(input_path):
-    raise 'Path provided is not a directory'
-  
-  logger.info('Reading meta...')
-  with open(os.path.join(input_path, 'entwine.json'), 'r') as meta_file:
-    meta = json.load(meta_file)
-
-  headers_path = os.path.join(input_path, 'h')
-  for header in os.listdir(headers_path):
-    if not os.path.isfile(os.path.join(headers_path, header)):
-      logger.warning('Skipping! %s' % header)
-      continue
-
-    header_id = int(header.split('-')[0])
-    name = 'tileset.json' if header_id is 0 else 'tileset-' + header
-    logging.info('Creating %s' % name)
-    data = get_tileset_json(header, input_path, meta)
-    with open(os.path.join(output_path, name), 'w') as outfile:
-      logging.info('Writing %s'  % name)
-      json.dump(data, outfile, indent=4)
-      logging.info('Finished %s' % name)
-
-def import_entwine_table(input_path, batch_header, groups, batched):
-  entwine_header_dtype = np.dtype([ (x['name'], x['type'].value) for x in batch_header ])
-  with open(input_path, 'rb') as raw_tile:
-    content = np.fromfile(raw_tile, dtype=entwine_header_dtype)
-    tile = create_pointcloud(content, mode=Mode.QUANTIZED, groups=groups, batch_columns=batched)
-    if 'OriginId' in tile.batch_table:
-      tile.batch_table.remove('OriginId') # Remove origin ID (artifact from cesium) when present
-    return tile
+def import_entwine_table(input_path, batch_header, groups, batched, chunk_size=None):
+  return TileConverter(batch_header, groups, batched, chunk_size=chunk_size).import_file(input_path)
 
 # Cesium does not support > 16 bit integers, store bytes in alternate
 class EntwineScemaType(Enum):
@@ -116,25 +51,123 @@ def get_schema_type(name, type):
     raise Exception('Unknown schema type: %s (%s)' % (raw_schema_type, name))
   return EntwineScemaType[raw_schema_type].value
 
-def convert_tiles(input_path, export_path, precision=None, validate=False, groups=None, batched=None):
-  total_points, total_tiles, high_precision_tiles = 0, 0, 0
+def get_entwine_schema(metadata):
+  return [ { 'name': str(x['name']), 'type': get_schema_type(x['name'], x['type']) } for x in metadata['schema'] ]
+
+def get_entwine_header(input_path):
   with open(os.path.join(input_path, 'entwine.json'), 'r') as meta_file:
-    metadata = json.load(meta_file)
-    header = [ { 'name': str(x['name']), 'type': get_schema_type(x['name'], x['type']) } for x in metadata['schema'] ]
+    return get_entwine_schema(json.load(meta_file))
+
+# Precision in meters used by the cli when none is given
+DEFAULT_PRECISION = 0.01
+
+# Prepared conversion from the entwine schema, build once and reuse for every tile
+class TileConverter(object):
+
+  def __init__(self, header, groups=None, batched=None, precision=DEFAULT_PRECISION, chunk_size=None):
+    self.header = header
+    self.dtype = np.dtype([ (x['name'], x['type'].value) for x in header ])
+    self.groups = groups
+    self.batched = batched
+    self.precision = precision
+    self.chunk_size = chunk_size
+
+  # Everything that changes the converted output
+  def get_settings(self):
+    return {
+      'version': __version__,
+      'schema': [ [ x['name'], x['type'].name ] for x in self.header ],
+      'groups': self.groups,
+      'batched': self.batched,
+      'precision': self.precision
+    }
+
+  @classmethod
+  def from_metadata(cls, metadata, *args, **kwargs):
+    return cls(get_entwine_schema(metadata), *args, **kwargs)
+
+  def read(self, content):
+    if isinstance(content, np.ndarray) and content.dtype.names is not None:
+      if content.dtype != self.dtype:
+        raise ValueError('Expected dtype %s but received %s' % (self.dtype, content.dtype))
+      return content
+    if isinstance(content, memoryview):
+      content = content.tobytes() # numpy 1.14 on python 2 cannot read from a memoryview
+    return np.frombuffer(content, dtype=self.dtype)
+
+  def read_file(self, input_path):
+    if self.chunk_size is None:
+      return np.fromfile(input_path, dtype=self.dtype)
+    # Memory map the tile so only the chunk being processed is paged in
+    return np.memmap(input_path, dtype=self.dtype, mode='r')
+
+  def create_tile(self, data):
+    tile = create_pointcloud(data, mode=Mode.QUANTIZED, groups=self.groups, batch_columns=self.batched, chunk_size=self.chunk_size)
+    if 'OriginId' in tile.batch_table:
+      tile.batch_table.remove('OriginId') # Remove origin ID (artifact from cesium) when present
+    return tile
+
+  def import_file(self, input_path):
+    return self.create_tile(self.read_file(input_path))
+
+  # Switch to floating quantized positions when quantizing would lose the required precision,
+  # a precision of None keeps the quantized positions
+  def apply_precision(self, tile):
+    if self.precision is not None and np.any((tile.bounds['max'] - tile.bounds['min']) / QUANTIZED_ECEF_CONSTANT > self.precision):
+      tile.mode = Mode.FLOATING_QUANTIZED
+    return tile.mode is Mode.FLOATING_QUANTIZED
+
+  def convert(self, content):
+    tile = self.create_tile(self.read(content))
+    self.apply_precision(tile)
+    return tile.to_bytes()
+
+def get_cesium_path(bin_file, export_path):
+  cesium_file_name = '%s.pnts' % os.path.splitext(os.path.basename(bin_file))[0]
+  return os.path.join(export_path, cesium_file_name)
+
+def convert_tiles(input_path, export_path, precision=DEFAULT_PRECISION, validate=False, groups=None, batched=None, chunk_size=None, store_path=None):
+  total_points, total_tiles, high_precision_tiles = 0, 0, 0
+  cached_tiles, duplicate_tiles = 0, 0
+  converter = TileConverter(get_entwine_header(input_path), groups, batched, precision, chunk_size)
+  store = None if store_path is None else TileStore(store_path, converter.get_settings())
+  if store is not None and not store.can_link(export_path):
+    raise Exception('Store %s must be on the same filesystem as %s' % (store_path, export_path))
 
-  
   for bin_file in glob.iglob(os.path.join(input_path, '*.bin')):
+    cesium_file_path = get_cesium_path(bin_file, export_path)
+
+    source_hash = None
+    if store is not None:
+      source_hash = store.hash_source(bin_file)
+      tile_hash = store.find_source(source_hash)
+      if tile_hash is not None:
+        logging.info('Reusing %s' % bin_file)
+        if validate:
+          logging.warning('\t- Skipping validation of a tile reused from the store')
+        store.link(tile_hash, cesium_file_path)
+        reader = PointcloudReader.load(cesium_file_path)
+        if 'FLOATING_POSITION_QUANTIZED' in reader.feature_table:
+          high_precision_tiles += 1
+        total_points += reader.total_points
+        total_tiles += 1
+        cached_tiles += 1
+        continue
+
     logging.info('Converting %s' % bin_file)
-    tile = import_entwine_table(bin_file, header, groups, batched)
+    tile = converter.import_file(bin_file)
   
     points_column = tile.points
-    if np.any((tile.bounds['max'] - tile.bounds['min']) / QUANTIZED_ECEF_CONSTANT > precision):
-      tile.mode = Mode.FLOATING_QUANTIZED
+    if converter.apply_precision(tile):
       high_precision_tiles += 1
 
-    cesium_file_name = '%s.pnts' % os.path.splitext(os.path.basename(bin_file))[0]
-    cesium_file_path = os.path.join(export_path, cesium_file_name)
-    tile.save(cesium_file_path)
+    if store is not None:
+      tile_hash, is_new = store.save(tile, source_hash)
+      store.link(tile_hash, cesium_file_path)
+      duplicate_tiles += 0 if is_new else 1
+    else:
+      remove_file(cesium_file_path) # The output may be a link into a tile store
+      tile.save(cesium_file_path)
 
     if validate:
       if points_column.mode is Mode.RTC_CENTER:
@@ -161,3 +194,121 @@ def convert_tiles(input_path, export_path, precision=None, validate=False, group
   logging.info('\t- Tiles {:,}'.format(total_tiles))
   logging.info('\t- High Precision Tiles {:,}'.format(high_precision_tiles))
   logging.info('\t- Points {:,}'.format(total_points))
+  if store is not None:
+    logging.info('\t- Cached Tiles {:,}'.format(cached_tiles))
+    logging.info('\t- Duplicate Tiles {:,}'.format(duplicate_tiles))
+
+# Compares a converted tile with the fields of its source without rerunning the conversion
+def compare_tile(reader, source, converter):
+  if reader.total_points != len(source):
+    return [ 'Expected %d points but found %d' % (len(source), reader.total_points) ]
+
+  # Rebuild the column names and their source fields the same way create_pointcloud groups them
+  groups = merge_dicts(DEFAULT_GROUPS, converter.groups or {})
+  grouped = set()
+  for selection in groups.values():
+    grouped.update(selection if isinstance(selection, list) else [selection])
+  columns = list(groups.items()) + [ (name, name) for name in source.dtype.names if name not in grouped and name != 'OriginId' ]
+  batched = converter.batched or []
+
+  errors = []
+  for name, selection in columns:
+    fields = selection if isinstance(selection, list) else [selection]
+    if name == 'position':
+      errors.extend(compare_positions(reader, source, fields, converter))
+      continue
+    elif name.lower() in FeatureColumn.TYPES:
+      table, key = reader.feature_table, name.upper()
+    else:
+      table, key = reader.batch_table, name
+
+    if key not in table:
+      errors.append('Missing column %s' % key)
+    elif table is reader.batch_table and name in batched:
+      errors.extend(compare_instanced(reader, source, key, fields, converter.chunk_size))
+    else:
+      actual = reader.feature(key) if table is reader.feature_table else reader.batch(key)
+      errors.extend(compare_values(key, actual, source, fields, converter.chunk_size))
+
+  return errors
+
+def compare_positions(reader, source, fields, converter):
+  # Without a precision the positions are quantized, allow one quantization step
+  tolerance = converter.precision
+  if tolerance is None:
+    tolerance = np.max(reader.feature_table.get('QUANTIZED_VOLUME_SCALE', [0])) / QUANTIZED_ECEF_CONSTANT
+
+  for start, stop in iter_chunks(len(source), converter.chunk_size):
+    expected = np.column_stack([ source[field][start:stop] for field in fields ])
+    distances = np.abs(reader.positions(start, stop) - expected)
+    if np.any(distances > tolerance):
+      return [ 'Position outside tolerance by %f' % np.max(distances) ]
+  return []
+
+def compare_values(name, actual, source, fields, chunk_size):
+  for start, stop in iter_chunks(len(source), chunk_size):
+    for idx, field in enumerate(fields):
+      values = actual[start:stop] if len(fields) == 1 else actual[start:stop, idx]
+      if not np.array_equal(values, source[field][start:stop]):
+        return [ 'Values of %s do not match' % name ]
+  return []
+
+# Instanced values are looked up through the batch ids, instanced[name][batch_id] must equal the source
+def compare_instanced(reader, source, name, fields, chunk_size):
+  if 'BATCH_ID' not in reader.feature_table:
+    return [ 'Missing column BATCH_ID' ]
+
+  instanced = reader.batch(name)
+  lookups = [ np.asarray(instanced if len(fields) == 1 else instanced[field]) for field in fields ]
+  batch_ids = reader.feature('BATCH_ID')
+  for start, stop in iter_chunks(len(source), chunk_size):
+    ids = batch_ids[start:stop]
+    if len(ids) > 0 and np.max(ids) >= min(len(x) for x in lookups):
+      return [ 'Batch ids of %s are out of range' % name ]
+    for lookup, field in zip(lookups, fields):
+      if not np.array_equal(lookup[ids], source[field][start:stop]):
+        return [ 'Instanced values of %s do not match' % name ]
+  return []
+
+def verify_tile(bin_file, export_path, converter):
+  cesium_file_path = get_cesium_path(bin_file, export_path)
+  if not os.path.isfile(cesium_file_path):
+    return bin_file, [ 'Missing %s' % cesium_file_path ]
+
+  # A malformed tile is reported as a failure of that tile instead of stopping the run
+  try:
+    reader = PointcloudReader.load(cesium_file_path)
+    errors = reader.validate()
+  except (ValueError, KeyError, TypeError, struct.error) as e:
+    return bin_file, [ 'Unreadable %s (%s)' % (cesium_file_path, e) ]
+  if len(errors) > 0:
+    return bin_file, errors
+
+  try:
+    source = np.memmap(bin_file, dtype=converter.dtype, mode='r')
+  except ValueError as e:
+    return bin_file, [ 'Unreadable source (%s)' % e ]
+  return bin_file, compare_tile(reader, source, converter)
+
+def verify_tiles(input_path, export_path, precision=DEFAULT_PRECISION, groups=None, batched=None, chunk_size=None, jobs=None):
+  total_tiles, failed_tiles = 0, 0
+  converter = TileConverter(get_entwine_header(input_path), groups, batched, precision, chunk_size)
+
+  verify = partial(verify_tile, export_path=export_path, converter=converter)
+  pool = Pool(jobs)
+  try:
+    for bin_file, errors in pool.imap_unordered(verify, glob.iglob(os.path.join(input_path, '*.bin'))):
+      total_tiles += 1
+      if len(errors) > 0:
+        failed_tiles += 1
+        logging.warning('Failed %s' % bin_file)
+        for error in errors:
+          logging.warning('\t- %s' % error)
+  finally:
+    pool.close()
+    pool.join()
+
+  logging.info('Completed Verification')
+  logging.info('\t- Tiles {:,}'.format(total_tiles))
+  logging.info('\t- Failed Tiles {:,}'.format(failed_tiles))
+  return failed_tiles
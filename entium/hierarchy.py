@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+
+from .cesium.tileset import DirectTile, ReferenceTile
+
+
+logger = logging.getLogger(__name__)
+
+def get_tileset_json(header, root_directory, global_meta):
+  tileset = {}
+
+  def _find_children(tile):
+    if tile.depth + 1 not in tileset:
+      return []
+    x = tile.x * 2
+    y = tile.y * 2
+    z = tile.z * 2
+
+    def is_within_cartesian(test_tile):
+      return x <= test_tile.x < x + 2 and y <= test_tile.y < y + 2 and z <= test_tile.z < z + 2
+
+    return filter(is_within_cartesian, tileset[tile.depth + 1])
+
+  def _link_children(parents):
+    for parent in parents:
+      if isinstance(parent, ReferenceTile):
+        continue
+      parent.children = _find_children(parent)
+      _link_children(parent.children)
+    return parents
+  
+  # Get basic info on depth requirements
+  base_depth = int(header.split('-')[0])
+  step_size = 0 if 'hierarchyStep' not in global_meta else global_meta['hierarchyStep']
+
+  tileset_path = os.path.join(root_directory, 'h', header)
+  with open(tileset_path) as data_file:
+    data = json.load(data_file)
+    for tile_file in data.keys():
+      tile_meta = map(int, tile_file.split('.')[0].split('-'))
+      depth = tile_meta[0]
+      if depth not in tileset:
+        tileset[depth] = []
+      is_reference = step_size != 0 and depth != base_depth and depth % step_size == 0
+      tileset[depth].append(ReferenceTile(*tile_meta) if is_reference else DirectTile(*tile_meta))
+
+  # Find all children at 
+  root = _link_children(tileset[base_depth])[0]
+
+  return {
+    'asset': {
+      'version': '0.0'
+    },
+    'geometricError': root.get_geometric_error(global_meta),
+    'root': root.get_json(global_meta)
+  }
+
+def convert_hierarchy(input_path, output_path):
+  if not os.path.isdir(input_path):
+    raise 'Path provided is not a directory'
+  
+  logger.info('Reading meta...')
+  with open(os.path.join(input_path, 'entwine.json'), 'r') as meta_file:
+    meta = json.load(meta_file)
+
+  headers_path = os.path.join(input_path, 'h')
+  for header in os.listdir(headers_path):
+    if not os.path.isfile(os.path.join(headers_path, header)):
+      logger.warning('Skipping! %s' % header)
+      continue
+
+    header_id = int(header.split('-')[0])
+    name = 'tileset.json' if header_id is 0 else 'tileset-' + header
+    logging.info('Creating %s' % name)
+    data = get_tileset_json(header, input_path, meta)
+    with open(os.path.join(output_path, name), 'w') as outfile:
+      logging.info('Writing %s'  % name)
+      json.dump(data, outfile, indent=4)
+      logging.info('Finished %s' % name)
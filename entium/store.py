@@ -0,0 +1,107 @@
+import errno
+import hashlib
+import json
+import os
+import tempfile
+
+
+# Hashes everything written through it, so tiles are hashed while they are streamed to disk
+class HashingWriter(object):
+
+  def __init__(self, write_buffer):
+    self.write_buffer = write_buffer
+    self.hash = hashlib.sha256()
+
+  def write(self, data):
+    self.hash.update(data)
+    self.write_buffer.write(data)
+
+  def hexdigest(self):
+    return self.hash.hexdigest()
+
+def makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+
+def remove_file(path):
+  try:
+    os.remove(path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+
+# Content addressed tiles, every unique .pnts is kept once and outputs are hard links to it.
+# Sources are keyed by the hash of the .bin and the conversion settings so identical sources
+# can skip conversion, across runs as well.
+class TileStore(object):
+
+  def __init__(self, store_path, settings=None):
+    self.store_path = store_path
+    self.tiles_path = os.path.join(store_path, 'tiles')
+    self.sources_path = os.path.join(store_path, 'sources')
+    self.settings_key = json.dumps(settings, sort_keys=True).encode('utf-8')
+
+    makedirs(self.tiles_path)
+    makedirs(self.sources_path)
+
+    # mkstemp creates private files, stored tiles get the permissions open() would give them
+    umask = os.umask(0)
+    os.umask(umask)
+    self.tile_mode = 0o666 & ~umask
+
+  def get_tile_path(self, tile_hash):
+    return os.path.join(self.tiles_path, '%s.pnts' % tile_hash)
+
+  def hash_source(self, input_path, block_size=1 << 20):
+    source_hash = hashlib.sha256(self.settings_key)
+    with open(input_path, 'rb') as source:
+      for block in iter(lambda: source.read(block_size), b''):
+        source_hash.update(block)
+    return source_hash.hexdigest()
+
+  def find_source(self, source_hash):
+    source_path = os.path.join(self.sources_path, source_hash)
+    if not os.path.isfile(source_path):
+      return None
+    with open(source_path, 'r') as source:
+      tile_hash = source.read().strip()
+    return tile_hash if os.path.isfile(self.get_tile_path(tile_hash)) else None
+
+  # Returns the hash of the tile and whether it was new to the store
+  def save(self, tile, source_hash=None):
+    handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.tiles_path)
+    try:
+      with os.fdopen(handle, 'wb') as temp_file:
+        writer = HashingWriter(temp_file)
+        tile.write(writer)
+
+      tile_hash = writer.hexdigest()
+      is_new = not os.path.isfile(self.get_tile_path(tile_hash))
+      if is_new:
+        os.chmod(temp_path, self.tile_mode)
+        os.rename(temp_path, self.get_tile_path(tile_hash))
+    finally:
+      remove_file(temp_path)
+
+    if source_hash is not None:
+      with open(os.path.join(self.sources_path, source_hash), 'w') as source:
+        source.write(tile_hash)
+
+    return tile_hash, is_new
+
+  def can_link(self, output_dir):
+    return os.stat(self.tiles_path).st_dev == os.stat(output_dir).st_dev
+
+  def link(self, tile_hash, output_path):
+    # Link next to the output and rename it over the output, an existing output is only
+    # replaced once the link exists and is never written through (it could be a stored tile)
+    temp_path = '%s.%d.tmp' % (output_path, os.getpid())
+    remove_file(temp_path)
+    os.link(self.get_tile_path(tile_hash), temp_path)
+    try:
+      os.rename(temp_path, output_path)
+    finally:
+      remove_file(temp_path) # rename leaves both names when the output already links to the tile